@@ -1,38 +1,49 @@
 import streamlit as st
-import ee
-import geemap.foliumap as geemap
-import pandas as pd
-from openai import OpenAI
+import streamlit.components.v1 as components
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import json
-import os
-import datetime
+import time
+from pathlib import Path
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from core import (EE_PROJECT_ID, FLOOD_DB_THRESHOLD, PERM_WATER_DB, FLOOD_BAND, make_roi, s1_collection, sar_scenes,
+                  get_sar_pair, get_opt_pair, flood_indicator, load_flood_mask, FLOOD_ARCHIVE, ARCHIVE_YEARS, ARCHIVE_EVENTS, archive_asset_id, archive_cog_url,
+                  stats_asset_id)
 
 # --- 1. CONFIGURATION & AUTH (THE FIX) ---
 st.set_page_config(page_title="FDEP Flood Intelligence", layout="wide")
 
+# Once per process: ee.Initialize state is global, so reruns and other
+# sessions reuse it
+@st.cache_resource(show_spinner=False)
 def auth_ee():
+    import ee
+
     # FORCE the specific project ID
-    MY_PROJECT_ID = "flood-intelligence-gee-12345"
+    MY_PROJECT_ID = EE_PROJECT_ID
     
     try:
         # Option 1: Try initializing with the explicit project ID immediately
         ee.Initialize(project=MY_PROJECT_ID)
+        return True
     except Exception:
         # Option 2: If that fails, rebuild credentials from secrets
         if "EARTHENGINE_TOKEN" in st.secrets:
-            credentials_path = os.path.expanduser("~/.config/earthengine/")
-            os.makedirs(credentials_path, exist_ok=True)
+            credentials_file = Path("~/.config/earthengine/credentials").expanduser()
             token_content = st.secrets["EARTHENGINE_TOKEN"]
             
             if not isinstance(token_content, str):
                 token_content = json.dumps(token_content)
             
-            with open(os.path.join(credentials_path, "credentials"), "w") as f:
-                f.write(token_content)
+            # Only touch the disk if the token isn't already there
+            if not credentials_file.exists() or credentials_file.read_text() != token_content:
+                credentials_file.parent.mkdir(parents=True, exist_ok=True)
+                credentials_file.write_text(token_content)
             
             # CRITICAL: Initialize with the specific project ID
             try:
                 ee.Initialize(project=MY_PROJECT_ID)
+                return True
             except Exception as e:
                 st.error(f"Authentication Failed: Could not connect to project '{MY_PROJECT_ID}'. Error: {e}")
                 st.stop()
@@ -40,41 +51,355 @@ def auth_ee():
             st.error("EARTHENGINE_TOKEN not found in Secrets!")
             st.stop()
 
-auth_ee()
-
-# --- 2. DATA ARCHIVE ---
-flood_archive = {
-    "2024": {
-        "San Diego Flash Floods (Jan)": {"lat": 32.71, "lon": -117.16, "dates": ["2023-12-01", "2024-01-15", "2024-01-22", "2024-01-30"]},
-        "Houston Floods (May)": {"lat": 29.76, "lon": -95.36, "dates": ["2024-04-01", "2024-04-15", "2024-05-02", "2024-05-10"]}
-    },
-    "2023": {
-        "Libya Dam Collapse (Sep)": {"lat": 32.76, "lon": 22.63, "dates": ["2023-08-01", "2023-09-01", "2023-09-12", "2023-09-20"]}
-    },
-    "2022": {
-        "Hurricane Ian (Florida)": {"lat": 26.64, "lon": -81.87, "dates": ["2022-09-01", "2022-09-15", "2022-09-29", "2022-10-05"]},
-        "Pakistan Floods (Sindh)": {"lat": 26.90, "lon": 68.10, "dates": ["2022-08-01", "2022-08-10", "2022-08-20", "2022-08-30"]},
-        "California Atmospheric River": {"lat": 38.58, "lon": -121.49, "dates": ["2022-12-01", "2022-12-15", "2023-01-05", "2023-01-15"]}
-    }
-}
-
-# --- 3. SIDEBAR CONTROLS ---
+# --- 2. SATELLITE PIPELINE ---
+# Stats reduce at a coarse preview scale by default (~100x fewer pixels
+# than native 10 m); REFINED_SCALE is opt-in from the sidebar
+PREVIEW_SCALE = 100
+REFINED_SCALE = 30
+# EASE-Grid 2.0: equal-area, so pixel count x scale^2 is the true area
+STATS_CRS = 'EPSG:6933'
+
+# EE image graphs keyed on plain coords/dates and held as live objects
+# (st.cache_resource doesn't pickle), so the stats, map and download jobs
+# share one filter chain instead of each rebuilding it
+@st.cache_resource(ttl=24 * 60 * 60, show_spinner=False)
+def sar_images(lat, lon, bs, be, as_, ae):
+    roi = make_roi(lat, lon)
+    return (roi, *get_sar_pair(roi, bs, be, as_, ae))
+
+@st.cache_resource(ttl=24 * 60 * 60, show_spinner=False)
+def opt_images(lat, lon, bs, be, as_, ae):
+    roi = make_roi(lat, lon)
+    return (roi, *get_opt_pair(roi, bs, be, as_, ae))
+
+@st.cache_resource(ttl=24 * 60 * 60, show_spinner=False)
+def flood_image(lat, lon, bs, be, as_, ae, asset_id=None):
+    _, before, after = sar_images(lat, lon, bs, be, as_, ae)
+    return load_flood_mask(before, after, asset_id)
+
+# Every scalar the UI needs in one getInfo() round-trip, cached on plain
+# dates/coords so chat reruns don't repeat it. Curated events (archive_event
+# set) read a persisted copy first and persist the live result on a miss.
+@st.cache_data(ttl=24 * 60 * 60, show_spinner=False)
+def compute_flood_stats(lat, lon, bs, be, as_, ae, threshold=FLOOD_DB_THRESHOLD, scale=PREVIEW_SCALE, asset_id=None,
+                        archive_event=None):
+    import ee
+
+    stats_id = stats_asset_id(archive_event, bs, be, as_, ae, scale, threshold) if archive_event else None
+    if stats_id:
+        stats = stored_flood_stats(stats_id)
+        if stats:
+            return stats
+
+    roi, before, after = sar_images(lat, lon, bs, be, as_, ae)
+    # Scene counts ride along in the same request, so empty windows can be
+    # flagged without a separate size().getInfo(). Counted from the same
+    # selection the mosaics use, so they're the scenes actually analysed.
+    base = s1_collection(roi)
+    before_scenes = sar_scenes(base, roi, bs, be).size()
+    after_scenes = sar_scenes(base, roi, as_, ae).size()
+    # Archived masks are already 1-or-masked, so they sum the same way. An
+    # empty window mosaics to a zero-band image the indicator can't build
+    # on, so it counts as nothing flooded rather than failing the request.
+    flooded = ee.Image(asset_id) if asset_id else ee.Image(ee.Algorithms.If(
+        before_scenes.min(after_scenes).eq(0),
+        ee.Image.constant(0).rename(FLOOD_BAND),
+        flood_indicator(before, after, threshold),
+    ))
+
+    # No bestEffort: area is derived from the pixel count at `scale`, so EE
+    # must not silently coarsen it (the ROI is well under maxPixels anyway).
+    # The equal-area grid makes every pixel exactly scale x scale m; the
+    # images' default EPSG:4326 would shrink them by cos(lat).
+    def reduce(img, reducer, band='VV'):
+        return img.reduceRegion(
+            reducer=reducer, geometry=roi, crs=STATS_CRS, scale=scale, maxPixels=1e9, tileScale=4
+        ).get(band, 0)
+
+    stats = ee.Dictionary({
+        'flooded_px': reduce(flooded, ee.Reducer.sum().unweighted(), FLOOD_BAND),
+        'before_mean': reduce(before, ee.Reducer.mean()),
+        'after_mean': reduce(after, ee.Reducer.mean()),
+        'before_scenes': before_scenes,
+        'after_scenes': after_scenes,
+    }).getInfo()
+    # Integer pixel count times the (exact, equal-area) pixel area
+    stats['flooded_ha'] = stats['flooded_px'] * scale * scale / 10000
+    if stats_id and stats['before_scenes'] and stats['after_scenes']:
+        persist_flood_stats(stats_id, stats)
+    return stats
+
+# getDownloadURL makes EE prepare the export; keyed like the mask itself so
+# re-clicks and other sessions get the URL for free
+@st.cache_data(ttl=60 * 60, show_spinner=False)
+def flood_download_url(lat, lon, bs, be, as_, ae, asset_id=None):
+    roi, _, _ = sar_images(lat, lon, bs, be, as_, ae)
+    flood_final = flood_image(lat, lon, bs, be, as_, ae, asset_id)
+    return flood_final.getDownloadURL({'name': 'flood_map', 'scale': 30, 'region': roi})
+
+SAR_VIS = {'min': -25, 'max': 0}
+
+FDEP_URL = "https://ca.dep.state.fl.us/arcgis/rest/services/OpenData/DSL_Cons_Lands/MapServer"
+
+# MapServer metadata, probed once a day rather than on every map build; the
+# conservation-lands service rarely changes. Failures raise, so they aren't
+# cached and the next rerun probes again.
+@st.cache_data(ttl=24 * 60 * 60, show_spinner=False)
+def fdep_layer_config(url):
+    with urllib.request.urlopen(f"{url}?f=json", timeout=10) as resp:
+        return json.load(resp)
+
+# ((kind, URL, attribution), None) for the overlay, drawn from the tile cache
+# when the service has one and from its export endpoint when it's dynamic;
+# (None, reason) when it can't be drawn
+def fdep_overlay():
+    try:
+        config = fdep_layer_config(FDEP_URL)
+    except (OSError, ValueError):
+        return None, "The FDEP Conservation Lands service can't be reached right now; the map is shown without it."
+    attr = config.get("copyrightText") or "FDEP"
+    if config.get("singleFusedMapCache"):
+        return ("tiles", f"{FDEP_URL}/tile/{{z}}/{{y}}/{{x}}", attr), None
+    if "Map" in config.get("capabilities", ""):
+        return ("export", f"{FDEP_URL}/export", attr), None
+    return None, "The FDEP Conservation Lands service serves neither map tiles nor map images; the map is shown without it."
+
+# One map per analysis; building it costs a getMapId call per EE layer.
+# EE tile URLs go stale, so they're trusted for TILE_URL_MAX_AGE in total.
+# A URL can sit in four caches in turn (_tile_url, build_map,
+# render_map_html, the session's copy), so each keeps it a quarter of that.
+TILE_URL_MAX_AGE = 60 * 60
+MAP_TTL = TILE_URL_MAX_AGE // 4
+
+@st.cache_resource(ttl=MAP_TTL, show_spinner=False)
+def build_map(lat, lon, bs, be, as_, ae, sensor, fdep_layer, archive_event=None):
+    # Map stack (geemap/folium/branca) is only imported once a map is built
+    import geemap.foliumap as geemap
+    from flood_layer import ClientFloodLayer
+    from esri_layer import ArcGISExportLayer
+
+    m = geemap.Map(center=[lat, lon], zoom=10)
+
+    # FDEP Layer
+    if fdep_layer:
+        kind, url, attr = fdep_layer
+        if kind == "tiles":
+            add_tile_layers(m, [(url, "FDEP Conservation Lands")], attr=attr, opacity=0.6)
+        else:
+            ArcGISExportLayer(url, "FDEP Conservation Lands", attr, opacity=0.6).add_to(m)
+
+    # SENTINEL-1 (RADAR)
+    if sensor == "Sentinel-1 (Radar)":
+        # Archived events with exported COGs skip EE tile rendering entirely
+        cogs = archived_cog_tiles(archive_event) if archive_event else None
+        if cogs:
+            before_tiles, after_tiles = add_tile_layers(m, [
+                (cogs[0], 'Before Storm'),
+                (cogs[1], 'After Storm'),
+            ], attr='Copernicus Sentinel-1 (COG)')
+        else:
+            _, before, after = sar_images(lat, lon, bs, be, as_, ae)
+            before_tiles, after_tiles = add_ee_layers(m, [
+                (before, SAR_VIS, 'Before Storm'),
+                (after, SAR_VIS, 'After Storm'),
+            ])
+        # Thresholded in the browser from the two tile sets above
+        ClientFloodLayer(
+            before_tiles.tiles, after_tiles.tiles, FLOOD_DB_THRESHOLD, PERM_WATER_DB,
+            SAR_VIS['min'], SAR_VIS['max'], slider_min=-3, slider_max=0, slider_step=0.05,
+        ).add_to(m)
+
+    # SENTINEL-2 (OPTICAL)
+    else:
+        _, before, after = opt_images(lat, lon, bs, be, as_, ae)
+        vis = {'min': 0, 'max': 3000, 'bands': ['B4', 'B3', 'B2']}
+        add_ee_layers(m, [
+            (before, vis, 'Before (Optical)'),
+            (after, vis, 'After (Optical)'),
+        ])
+
+    m.add_layer_control()
+    return m
+
+# EE map IDs stay valid for hours: resolve each distinct (image graph, vis)
+# pair once and serve it as a plain folium tile layer afterwards
+@st.cache_data(ttl=MAP_TTL, show_spinner=False)
+def _tile_url(image_json, vis):
+    import ee
+
+    image = ee.Image(ee.deserializer.fromJSON(image_json))
+    return image.getMapId(dict(vis))['tile_fetcher'].url_format
+
+def ee_tile_url(image, vis):
+    return _tile_url(image.serialize(), vis)
+
+# Worker threads carrying the script run context, so cached functions called
+# from them behave as they do on the main thread
+def script_pool(max_workers):
+    return ThreadPoolExecutor(max_workers=max_workers, initializer=add_script_run_ctx, initargs=(None, get_script_run_ctx()))
+
+# Uncached layers each need a getMapId request; resolve them concurrently
+# and add them in the original order so the layer stack is unchanged
+def add_ee_layers(m, layers):
+    with script_pool(len(layers)) as ex:
+        urls = list(ex.map(lambda spec: ee_tile_url(spec[0], spec[1]), layers))
+    return add_tile_layers(m, [(url, name) for url, (_, _, name) in zip(urls, layers)], attr='Google Earth Engine')
+
+def add_tile_layers(m, layers, attr, **kwargs):
+    import folium
+
+    tiles = [folium.TileLayer(tiles=url, attr=attr, name=name, overlay=True, control=True, **kwargs) for url, name in layers]
+    for tile in tiles:
+        tile.add_to(m)
+    return tiles
+
+# Pre-rendered HTML so reruns skip folium's render() entirely
+@st.cache_data(ttl=MAP_TTL, show_spinner=False)
+def render_map_html(lat, lon, bs, be, as_, ae, sensor, fdep_layer, archive_event=None):
+    return build_map(lat, lon, bs, be, as_, ae, sensor, fdep_layer, archive_event).get_root().render()
+
+# --- 3. DATA ARCHIVE ---
+# Masks exported by export_archive.py; checked lazily so events without an
+# asset yet fall back to the live pipeline
+@st.cache_data(ttl=60 * 60, show_spinner=False)
+def archived_flood_asset(event_name):
+    import ee
+
+    asset_id = archive_asset_id(event_name)
+    try:
+        ee.data.getAsset(asset_id)
+    except ee.EEException:
+        return None
+    return asset_id
+
+# Persisted stats are a one-feature table asset; a missing asset (or one
+# whose export hasn't finished) just means a live reduction
+def stored_flood_stats(stats_id):
+    import ee
+
+    try:
+        return ee.FeatureCollection(stats_id).first().toDictionary().getInfo()
+    except ee.EEException:
+        return None
+
+# Runs once per key per process (compute_flood_stats is cached); a second
+# worker racing on the same key fails harmlessly since the asset id is taken
+def persist_flood_stats(stats_id, stats):
+    import ee
+
+    try:
+        ee.batch.Export.table.toAsset(
+            collection=ee.FeatureCollection([ee.Feature(None, stats)]),
+            description=stats_id.rsplit('/', 1)[-1],
+            assetId=stats_id,
+        ).start()
+    except ee.EEException:
+        pass
+
+# Before/after SAR COGs exported by export_archive.py, tiled through geemap's
+# TiTiler endpoint with the same dB stretch as the EE layers. A hosted tiler
+# rather than localtileserver, since browsers can't reach the app host.
+@st.cache_data(ttl=60 * 60, show_spinner=False)
+def archived_cog_tiles(event_name):
+    import geemap.foliumap as geemap
+
+    urls = [archive_cog_url(event_name, which) for which in ("before", "after")]
+    try:
+        for url in urls:
+            urllib.request.urlopen(urllib.request.Request(url, method="HEAD"), timeout=5)
+    except OSError:
+        return None
+    # The tiler is a third-party service: if it's slow or down, the map
+    # falls back to EE layers rather than failing the analysis
+    rescale = f"{SAR_VIS['min']},{SAR_VIS['max']}"
+    try:
+        return tuple(geemap.cog_tile(url, rescale=rescale) for url in urls)
+    except Exception:
+        return None
+
+# --- 4. AI ASSISTANT ---
+CHAT_MODEL = "gpt-3.5-turbo"
+REPLY_CACHE_SIZE = 256
+# Only the most recent messages go to the model, so token cost per reply is bounded
+CHAT_HISTORY_MESSAGES = 6
+SYSTEM_TEMPLATE = "You are an expert Flood Response Analyst.\nEvent: {event}. Flooded: {ha:.2f} ha."
+
+# One client (and HTTP connection pool) per process instead of per message
+@st.cache_resource(show_spinner=False)
+def openai_client():
+    from openai import OpenAI
+    return OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
+
+# Finished replies shared across sessions, so a repeated question is free.
+# Streams can't go through st.cache_data, hence a plain bounded dict.
+@st.cache_resource(show_spinner=False)
+def reply_cache():
+    return {}
+
+def remember_reply(cache, key, reply):
+    if len(cache) >= REPLY_CACHE_SIZE:
+        cache.pop(next(iter(cache)), None)
+    cache[key] = reply
+
+# Yield tokens as they arrive so the first words show in ~200 ms
+def stream_reply(messages):
+    stream = openai_client().chat.completions.create(model=CHAT_MODEL, messages=messages, stream=True)
+    for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+# Chat reruns only this fragment: sending a message never replays the
+# satellite pipeline or the map. Analysis results come from session_state,
+# which the main run fills in.
+@st.fragment
+def chat_fragment():
+    event_name = st.session_state["analysis_event"]
+    flooded_ha = st.session_state["flooded_ha"]
+    # The history is sent to the model, so it starts over with each event
+    # rather than carrying another event's questions and figures
+    if st.session_state.get("chat_event") != event_name:
+        st.session_state.messages = []
+        st.session_state["chat_event"] = event_name
+    for msg in st.session_state.messages: st.chat_message(msg["role"]).write(msg["content"])
+
+    if prompt := st.chat_input("Ask about this event..."):
+        st.chat_message("user").write(prompt)
+        st.session_state.messages.append({"role": "user", "content": prompt})
+        
+        system = SYSTEM_TEMPLATE.format(event=event_name, ha=flooded_ha)
+        # The history ends with the prompt just appended
+        history = st.session_state.messages[-CHAT_HISTORY_MESSAGES:]
+        # Start on a question, never on a reply cut off from its exchange
+        while history[0]["role"] == "assistant":
+            history = history[1:]
+        messages = [{"role": "system", "content": system}] + history
+        # Keyed on exactly what the model sees
+        key = (system, tuple((m["role"], m["content"]) for m in history))
+        
+        try:
+            cache = reply_cache()
+            if key in cache:
+                reply = cache[key]
+                st.chat_message("assistant").write(reply)
+            else:
+                reply = st.chat_message("assistant").write_stream(stream_reply(messages))
+                remember_reply(cache, key, reply)
+            st.session_state.messages.append({"role": "assistant", "content": reply})
+        except Exception as e:
+            st.error(f"AI Error: {e}")
+
+# --- 5. SIDEBAR CONTROLS ---
 st.sidebar.title("FDEP Flood Intelligence")
 
 st.sidebar.header("1. Select Event")
-selected_year = st.sidebar.selectbox("Year", list(flood_archive.keys()), index=2)
-event_list = list(flood_archive[selected_year].keys())
-selected_event_name = st.sidebar.selectbox("Event", event_list)
+selected_year = st.sidebar.selectbox("Year", ARCHIVE_YEARS, index=2)
+selected_event_name = st.sidebar.selectbox("Event", ARCHIVE_EVENTS[selected_year])
 
 # Load Params
-params = flood_archive[selected_year][selected_event_name]
+params = FLOOD_ARCHIVE[selected_year][selected_event_name]
 lat, lon = params["lat"], params["lon"]
 
-# Helper to force dates to simple strings
-def make_date_obj(date_str):
-    return datetime.datetime.strptime(date_str, "%Y-%m-%d").date()
-
-default_dates = [make_date_obj(x) for x in params["dates"]]
+default_dates = params["dates"]
 
 with st.sidebar.expander("Date Settings", expanded=False):
     col1, col2 = st.columns(2)
@@ -86,8 +411,13 @@ with st.sidebar.expander("Date Settings", expanded=False):
 st.sidebar.header("2. Sensor & Layers")
 sensor_type = st.sidebar.radio("Satellite", ["Sentinel-1 (Radar)", "Sentinel-2 (Optical)"])
 show_fdep = st.sidebar.checkbox("Overlay FDEP Conservation Lands", value=False)
+fdep_layer, fdep_note = fdep_overlay() if show_fdep else (None, None)
+if fdep_note:
+    st.sidebar.info(fdep_note)
+refine_area = st.sidebar.checkbox(f"Refine flood area ({REFINED_SCALE} m)", value=False)
+stats_scale = REFINED_SCALE if refine_area else PREVIEW_SCALE
 
-# --- 4. EXECUTION ---
+# --- 6. EXECUTION ---
 if 'analysis_active' not in st.session_state:
     st.session_state.analysis_active = False
 
@@ -95,99 +425,92 @@ if st.sidebar.button("Run Analysis", type="primary"):
     st.session_state.analysis_active = True
 
 if st.session_state.analysis_active:
+    # EE is only imported and initialized once an analysis is requested, so
+    # a cold container serves the sidebar without loading the client stack
+    import ee
+    _ = auth_ee()
     st.subheader(f"Analysis: {selected_event_name}")
     
     with st.spinner('Processing Satellite Data...'):
-        roi = ee.Geometry.Point([lon, lat]).buffer(10000)
-        m = geemap.Map(center=[lat, lon], zoom=10)
         flooded_ha = 0
         
-        # Date Strings for GEE
-        start_b_str = d1.strftime("%Y-%m-%d")
-        end_b_str = d2.strftime("%Y-%m-%d")
-        start_a_str = d3.strftime("%Y-%m-%d")
-        end_a_str = d4.strftime("%Y-%m-%d")
-
-        # FDEP Layer
-        if show_fdep:
-            try:
-                fdep_url = "https://ca.dep.state.fl.us/arcgis/rest/services/OpenData/DSL_Cons_Lands/MapServer"
-                m.add_esri_layer(fdep_url, name="FDEP Conservation Lands", opacity=0.6)
-            except:
-                pass
+        # Archived masks only match the event's curated date windows
+        archive_event = selected_event_name if (d1, d2, d3, d4) == default_dates else None
+        asset_id = archived_flood_asset(archive_event) if archive_event else None
+
+        # Date Strings for GEE, formatted once per date selection; chat
+        # reruns reuse them from session_state
+        dates = (d1, d2, d3, d4)
+        if st.session_state.get("date_key") != dates:
+            st.session_state["date_key"] = dates
+            st.session_state["date_strs"] = tuple(d.isoformat() for d in dates)
+        start_b_str, end_b_str, start_a_str, end_a_str = st.session_state["date_strs"]
+
+        # This session's last map HTML is reused as-is while its inputs are
+        # unchanged, skipping even the st.cache_data lookup and unpickling,
+        # until it is as old as the caches behind it would let it get
+        map_key = (lat, lon, start_b_str, end_b_str, start_a_str, end_a_str, sensor_type, fdep_layer, archive_event)
+        # Likewise the stats: toggling the map overlay or sensor-independent
+        # widgets doesn't touch compute_flood_stats
+        stats_key = (lat, lon, start_b_str, end_b_str, start_a_str, end_a_str, stats_scale, asset_id, archive_event)
+        need_map = (st.session_state.get("map_key") != map_key
+                    or time.time() - st.session_state.get("map_time", 0) > MAP_TTL)
+        need_stats = sensor_type == "Sentinel-1 (Radar)" and st.session_state.get("stats_key") != stats_key
+
+        # Map tiles and stats are independent EE requests: overlap them
+        if need_map or need_stats:
+            with script_pool(2) as ex:
+                if need_map:
+                    map_f = ex.submit(render_map_html, *map_key)
+                if need_stats:
+                    stats_f = ex.submit(compute_flood_stats, lat, lon, start_b_str, end_b_str, start_a_str, end_a_str, scale=stats_scale,
+                                        asset_id=asset_id, archive_event=archive_event)
+                if need_map:
+                    # An empty date window has no bands to draw; keep going
+                    # so the stats can say so
+                    try:
+                        st.session_state["map_html"] = map_f.result()
+                        st.session_state["map_key"] = map_key
+                        st.session_state["map_time"] = time.time()
+                    except ee.EEException as e:
+                        st.error(f"Map unavailable: {e}")
+                if need_stats:
+                    st.session_state["stats"] = stats_f.result()
+                    st.session_state["stats_key"] = stats_key
+        map_html = st.session_state["map_html"] if st.session_state.get("map_key") == map_key else None
 
-        # SENTINEL-1 (RADAR)
         if sensor_type == "Sentinel-1 (Radar)":
-            def get_sar(start, end):
-                return (ee.ImageCollection('COPERNICUS/S1_GRD')
-                        .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VV'))
-                        .filter(ee.Filter.eq('instrumentMode', 'IW'))
-                        .filterBounds(roi)
-                        .filterDate(start, end)
-                        .mosaic().clip(roi))
-
-            before = get_sar(start_b_str, end_b_str)
-            after = get_sar(start_a_str, end_a_str)
-
-            # Detect Flood
-            diff = after.focal_mean(50).divide(before.focal_mean(50))
-            flood_mask = diff.select('VV').lt(0.8)
-            flood_final = flood_mask.updateMask(before.select('VV').gt(-15)).selfMask()
-            
-            m.add_layer(before, {'min': -25, 'max': 0}, 'Before Storm')
-            m.add_layer(after, {'min': -25, 'max': 0}, 'After Storm')
-            m.add_layer(flood_final, {'palette': ['red']}, 'FLOOD DETECTED')
-            
             # Stats
-            area = flood_final.multiply(ee.Image.pixelArea()).reduceRegion(
-                reducer=ee.Reducer.sum(), geometry=roi, scale=10, maxPixels=1e9
-            ).getInfo()
-            flooded_ha = area.get('VV', 0) / 10000
-            
-            # Download Button
-            try:
-                url = flood_final.getDownloadURL({'name': 'flood_map', 'scale': 30, 'region': roi})
-                st.sidebar.markdown(f"[Download GeoTIFF]({url})")
-            except: pass
+            stats = st.session_state["stats"]
+            flooded_ha = stats['flooded_ha']
 
-        # SENTINEL-2 (OPTICAL)
-        else:
-            def get_opt(start, end):
-                return (ee.ImageCollection('COPERNICUS/S2_SR')
-                        .filterBounds(roi)
-                        .filterDate(start, end)
-                        .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', 20))
-                        .median().clip(roi))
-            
-            before = get_opt(start_b_str, end_b_str)
-            after = get_opt(start_a_str, end_a_str)
-            vis = {'min': 0, 'max': 3000, 'bands': ['B4', 'B3', 'B2']}
-            m.add_layer(before, vis, 'Before (Optical)')
-            m.add_layer(after, vis, 'After (Optical)')
-
-    m.to_streamlit(height=600)
+    if map_html:
+        components.html(map_html, height=600)
     
     if sensor_type == "Sentinel-1 (Radar)":
-        st.success(f"Detected Flood Extent: {flooded_ha:.2f} Hectares")
+        st.success(f"Detected Flood Extent: {flooded_ha:.2f} Hectares (at {stats_scale} m)")
+        if not stats['before_scenes'] or not stats['after_scenes']:
+            st.warning(f"No Sentinel-1 scenes in one of the date windows ({stats['before_scenes']} before / "
+                       f"{stats['after_scenes']} after); widen it to get a flood estimate.")
+        else:
+            st.caption(f"Mean VV backscatter: {stats['before_mean']:.1f} dB before, {stats['after_mean']:.1f} dB after "
+                       f"({stats['before_scenes']} / {stats['after_scenes']} Sentinel-1 scenes mosaicked)")
+
+        # Download Button: the export URL is only prepared on request
+        download_key = (lat, lon, start_b_str, end_b_str, start_a_str, end_a_str, asset_id)
+        if st.session_state.get("download", (None,))[0] != download_key:
+            if st.sidebar.button("Prepare GeoTIFF download"):
+                try:
+                    url = flood_download_url(*download_key)
+                    st.session_state["download"] = (download_key, url)
+                except ee.EEException as e:
+                    st.sidebar.error(f"Download unavailable: {e}")
+        if st.session_state.get("download", (None,))[0] == download_key:
+            st.sidebar.link_button("Download GeoTIFF", st.session_state["download"][1])
 
     # --- AI SECTION ---
     st.divider()
     st.subheader("AI Situation Report")
-    
-    if "messages" not in st.session_state: st.session_state.messages = []
-    for msg in st.session_state.messages: st.chat_message(msg["role"]).write(msg["content"])
-
-    if prompt := st.chat_input("Ask about this event..."):
-        st.chat_message("user").write(prompt)
-        st.session_state.messages.append({"role": "user", "content": prompt})
-        
-        context = f"Event: {selected_event_name}. Flooded: {flooded_ha:.2f} ha. User Question: {prompt}"
-        
-        try:
-            client = OpenAI(api_key=st.secrets["OPENAI_API_KEY"])
-            response = client.chat.completions.create(model="gpt-3.5-turbo", messages=[{"role": "system", "content": context}, {"role": "user", "content": prompt}])
-            reply = response.choices[0].message.content
-            st.chat_message("assistant").write(reply)
-            st.session_state.messages.append({"role": "assistant", "content": reply})
-        except Exception as e:
-            st.error(f"AI Error: {e}")
+    st.session_state["analysis_event"] = selected_event_name
+    st.session_state["flooded_ha"] = flooded_ha
+    chat_fragment()
@@ -0,0 +1,180 @@
+import hashlib
+import re
+from datetime import date
+from functools import lru_cache
+from math import cos, radians
+from types import MappingProxyType
+
+# Shared Earth Engine pipeline: imported by the Streamlit app and by the
+# offline export script, so it must not touch Streamlit. ee is imported
+# inside the helpers that build EE objects: the app imports this module for
+# the event archive on every launch, before any analysis needs EE.
+EE_PROJECT_ID = "flood-intelligence-gee-12345"
+ASSET_ROOT = f"projects/{EE_PROJECT_ID}/assets/flood_archive"
+COG_BUCKET = "flood-intelligence-archive"
+
+# --- SATELLITE PIPELINE ---
+# S1_GRD is in dB, so the after/before ratio test becomes a difference:
+# 10 * log10(0.8) ~= -0.97 dB
+FLOOD_DB_THRESHOLD = -0.97
+PERM_WATER_DB = -15
+FLOOD_BAND = 'flood_detected'
+SAR_MAX_SCENES = 3
+SAR_FOOTPRINT_MARGIN_M = 100
+OPT_MAX_SCENES = 5
+
+ROI_HALF_WIDTH_KM = 10
+
+# Planar lat/lon box instead of Point.buffer(): no 64-gon tessellation or
+# geodesic edges, and filterBounds/clip/reduceRegion get a min/max test
+@lru_cache(maxsize=None)
+def roi_bounds(lat, lon, km=ROI_HALF_WIDTH_KM):
+    dlat = km / 111
+    dlon = km / (111 * cos(radians(lat)))
+    return (lon - dlon, lat - dlat, lon + dlon, lat + dlat)
+
+def make_roi(lat, lon):
+    import ee
+    return ee.Geometry.Rectangle(list(roi_bounds(lat, lon)), proj='EPSG:4326', geodesic=False)
+
+# Before/after share one filtered base collection per ROI and differ only
+# by filterDate, so the serialized graph carries the common filters once
+def s1_collection(roi):
+    import ee
+    return (ee.ImageCollection('COPERNICUS/S1_GRD')
+            .filter(ee.Filter.listContains('transmitterReceiverPolarisation', 'VV'))
+            .filter(ee.Filter.eq('instrumentMode', 'IW'))
+            .filterBounds(roi)
+            # Only VV is used downstream; dropping VH/angle halves what the
+            # mosaic and smoothing passes touch
+            .select('VV'))
+
+def s2_collection(roi):
+    import ee
+    return (ee.ImageCollection('COPERNICUS/S2_SR')
+            .filterBounds(roi)
+            .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', 20))
+            # RGB visualisation bands only
+            .select(['B2', 'B3', 'B4']))
+
+# The scenes that feed a window's mosaic. mosaic() fills whatever the newest
+# scenes don't cover from older ones, and filterBounds only promises a scene
+# touches the ROI. So the cap on how many scenes enter the graph only applies
+# when the newest ones' footprints cover the whole ROI; otherwise every scene
+# in the window is kept rather than leaving holes that would read as dry land.
+def sar_scenes(base, roi, start, end):
+    import ee
+    scenes = base.filterDate(start, end)
+    newest = scenes.limit(SAR_MAX_SCENES, 'system:time_start', False)
+    covered = newest.geometry().contains(roi, SAR_FOOTPRINT_MARGIN_M)
+    return ee.ImageCollection(ee.Algorithms.If(covered, newest, scenes))
+
+def get_sar(base, roi, start, end):
+    # Oldest-first so the latest pass ends up on top
+    return sar_scenes(base, roi, start, end).sort('system:time_start').mosaic().clip(roi)
+
+def get_opt(base, roi, start, end):
+    return (base
+            .filterDate(start, end)
+            # Per-pixel median over the clearest few scenes, not all of them
+            .limit(OPT_MAX_SCENES, 'CLOUDY_PIXEL_PERCENTAGE')
+            .median().clip(roi))
+
+def get_sar_pair(roi, bs, be, as_, ae):
+    base = s1_collection(roi)
+    return get_sar(base, roi, bs, be), get_sar(base, roi, as_, ae)
+
+def get_opt_pair(roi, bs, be, as_, ae):
+    base = s2_collection(roi)
+    return get_opt(base, roi, bs, be), get_opt(base, roi, as_, ae)
+
+# Box mean as a 1-D row pass then a 1-D column pass: O(2k) work per pixel
+# instead of the O(k^2) 2-D circle kernel focal_mean(50) used. Radius is
+# in meters (the original 50 px at native 10 m): EE sizes pixel kernels at
+# the request scale, so a pixel radius would smooth ~10 km at the 100 m
+# preview but ~1 km in 10 m exports, and their areas wouldn't compare.
+SMOOTH_RADIUS_M = 500
+
+# Built once (after ee.Initialize) and shared by the before and after passes
+@lru_cache(maxsize=None)
+def smooth_kernels():
+    import ee
+    return (ee.Kernel.rectangle(SMOOTH_RADIUS_M, 0, 'meters', True),
+            ee.Kernel.rectangle(0, SMOOTH_RADIUS_M, 'meters', True))
+
+# Pinned to float32 so the difference/threshold below never runs in double
+def smooth(img):
+    row, col = smooth_kernels()
+    return img.convolve(row).convolve(col).toFloat()
+
+# 0/1 flood indicator: enough for area sums, which don't need the masked
+# copy that selfMask() builds for display and export. The pointwise
+# difference/threshold/permanent-water tests are one fused expression node.
+def flood_indicator(before, after, threshold=FLOOD_DB_THRESHOLD):
+    # expression() is an instance method; every input is named in the map
+    return before.expression(
+        f"(AF - BF < {threshold}) && (B > {PERM_WATER_DB})",
+        {'AF': smooth(after), 'BF': smooth(before), 'B': before},
+    ).rename(FLOOD_BAND)
+
+def detect_flood(before, after, threshold=FLOOD_DB_THRESHOLD):
+    return flood_indicator(before, after, threshold).selfMask()
+
+# A precomputed mask (see export_archive.py) skips the smoothing/threshold graph
+def load_flood_mask(before, after, asset_id=None, threshold=FLOOD_DB_THRESHOLD):
+    import ee
+    if asset_id:
+        return ee.Image(asset_id)
+    return detect_flood(before, after, threshold)
+
+# --- DATA ARCHIVE ---
+flood_archive = {
+    "2024": {
+        "San Diego Flash Floods (Jan)": {"lat": 32.71, "lon": -117.16, "dates": ["2023-12-01", "2024-01-15", "2024-01-22", "2024-01-30"]},
+        "Houston Floods (May)": {"lat": 29.76, "lon": -95.36, "dates": ["2024-04-01", "2024-04-15", "2024-05-02", "2024-05-10"]}
+    },
+    "2023": {
+        "Libya Dam Collapse (Sep)": {"lat": 32.76, "lon": 22.63, "dates": ["2023-08-01", "2023-09-01", "2023-09-12", "2023-09-20"]}
+    },
+    "2022": {
+        "Hurricane Ian (Florida)": {"lat": 26.64, "lon": -81.87, "dates": ["2022-09-01", "2022-09-15", "2022-09-29", "2022-10-05"]},
+        "Pakistan Floods (Sindh)": {"lat": 26.90, "lon": 68.10, "dates": ["2022-08-01", "2022-08-10", "2022-08-20", "2022-08-30"]},
+        "California Atmospheric River": {"lat": 38.58, "lon": -121.49, "dates": ["2022-12-01", "2022-12-15", "2023-01-05", "2023-01-15"]}
+    }
+}
+
+# Parsed once at import; the app's date widgets take datetime.date directly.
+# Read-only views, since every session shares the same module objects.
+FLOOD_ARCHIVE = MappingProxyType({
+    year: MappingProxyType({
+        name: MappingProxyType({"lat": v["lat"], "lon": v["lon"], "dates": tuple(date.fromisoformat(x) for x in v["dates"])})
+        for name, v in events.items()
+    })
+    for year, events in flood_archive.items()
+})
+
+# Selectbox options, built once instead of list(...keys()) per rerun
+ARCHIVE_YEARS = tuple(FLOOD_ARCHIVE)
+ARCHIVE_EVENTS = MappingProxyType({year: tuple(events) for year, events in FLOOD_ARCHIVE.items()})
+
+# Precomputed outputs live at deterministic names per event: the flood mask
+# as an EE asset, the before/after SAR as public Cloud Optimized GeoTIFFs
+def archive_slug(event_name):
+    return re.sub(r'[^A-Za-z0-9]+', '_', event_name).strip('_')
+
+def archive_asset_id(event_name):
+    return f"{ASSET_ROOT}/{archive_slug(event_name)}"
+
+def archive_cog_url(event_name, which):
+    return f"https://storage.googleapis.com/{COG_BUCKET}/{archive_slug(event_name)}_{which}.tif"
+
+# Flood stats for a curated event, persisted by the app after its first live
+# reduction; keyed on everything that changes the numbers. Persisted tables
+# never expire, so bump STATS_VERSION whenever the smoothing, detection or
+# area logic changes.
+STATS_VERSION = 3
+
+def stats_asset_id(event_name, bs, be, as_, ae, scale, threshold=FLOOD_DB_THRESHOLD):
+    key = f"{STATS_VERSION}|{event_name}|{bs}|{be}|{as_}|{ae}|{scale}|{threshold}"
+    key = hashlib.md5(key.encode()).hexdigest()[:12]
+    return f"{ASSET_ROOT}/flood_stats_{key}"
@@ -0,0 +1,36 @@
+from folium.map import Layer
+from jinja2 import Template
+
+# Dynamic (untiled) ArcGIS MapServer as a Leaflet tile layer: each tile is
+# one export request for that tile's Web Mercator bounds, so services
+# without a tile cache still draw like any other overlay.
+class ArcGISExportLayer(Layer):
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = new (L.TileLayer.extend({
+            getTileUrl: function(coords) {
+                var size = this.getTileSize();
+                var crs = L.CRS.EPSG3857;
+                var nw = crs.project(this._map.unproject(coords.scaleBy(size), coords.z));
+                var se = crs.project(this._map.unproject(coords.add([1, 1]).scaleBy(size), coords.z));
+                return {{ this.export_url|tojson }} + L.Util.getParamString({
+                    bbox: [nw.x, se.y, se.x, nw.y].join(','),
+                    bboxSR: 3857,
+                    imageSR: 3857,
+                    size: size.x + ',' + size.y,
+                    format: 'png32',
+                    transparent: true,
+                    f: 'image'
+                });
+            }
+        }))('', {opacity: {{ this.opacity }}, attribution: {{ this.attr|tojson }}});
+        {{ this.get_name() }}.addTo({{ this._parent.get_name() }});
+        {% endmacro %}
+    """)
+
+    def __init__(self, export_url, name, attr, opacity=1.0):
+        super().__init__(name=name, overlay=True, control=True, show=True)
+        self._name = "ArcGISExportLayer"
+        self.export_url = export_url
+        self.attr = attr
+        self.opacity = opacity
@@ -0,0 +1,53 @@
+import ee
+
+from core import (EE_PROJECT_ID, ASSET_ROOT, COG_BUCKET, make_roi, get_sar_pair, detect_flood, flood_archive,
+                  archive_slug, archive_asset_id)
+
+# --- OFFLINE EXPORT ---
+# Run once (python export_archive.py) with local Earth Engine credentials.
+# Writes each curated event's flood mask to ASSET_ROOT and its before/after
+# SAR to COG_BUCKET as Cloud Optimized GeoTIFFs (the bucket must allow public
+# reads); the app picks them up automatically once the tasks finish.
+ee.Initialize(project=EE_PROJECT_ID)
+
+try:
+    ee.data.getAsset(ASSET_ROOT)
+except ee.EEException:
+    ee.data.createFolder(ASSET_ROOT)
+
+for year, events in flood_archive.items():
+    for name, params in events.items():
+        roi = make_roi(params["lat"], params["lon"])
+        bs, be, as_, ae = params["dates"]
+        before, after = get_sar_pair(roi, bs, be, as_, ae)
+        flood_final = detect_flood(before, after)
+
+        asset_id = archive_asset_id(name)
+        task = ee.batch.Export.image.toAsset(
+            image=flood_final,
+            description=archive_slug(name),
+            assetId=asset_id,
+            region=roi,
+            scale=10,
+            maxPixels=1e9,
+            # Masks are categorical: downsample pyramids by mode, not mean
+            pyramidingPolicy={".default": "mode"},
+        )
+        task.start()
+        print(f"{year} | {name} -> {asset_id} (task {task.id})")
+
+        for which, img in (("before", before), ("after", after)):
+            prefix = f"{archive_slug(name)}_{which}"
+            task = ee.batch.Export.image.toCloudStorage(
+                image=img,
+                description=prefix,
+                bucket=COG_BUCKET,
+                fileNamePrefix=prefix,
+                region=roi,
+                scale=10,
+                maxPixels=1e9,
+                fileFormat="GeoTIFF",
+                formatOptions={"cloudOptimized": True},
+            )
+            task.start()
+            print(f"{year} | {name} -> gs://{COG_BUCKET}/{prefix}.tif (task {task.id})")
@@ -0,0 +1,114 @@
+from folium.map import Layer
+from jinja2 import Template
+
+# Flood overlay computed in the browser from the before/after SAR tiles the
+# map already loads, so thresholding costs no EE tile pyramid and moving the
+# slider never reruns the app. Tiles arrive as 8-bit grey stretched over
+# [vis_min, vis_max] dB; each pixel is decoded back to dB before the test,
+# which mirrors detect_flood() in core.py (minus its smoothing, which the
+# tile pyramid's averaging roughly stands in for at map zooms).
+class ClientFloodLayer(Layer):
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = (function() {
+            var threshold = {{ this.threshold }};
+            var beforeUrl = {{ this.before_url|tojson }};
+            var afterUrl = {{ this.after_url|tojson }};
+            var visMin = {{ this.vis_min }}, visSpan = {{ this.vis_max - this.vis_min }};
+            var permWater = {{ this.perm_water_db }};
+            var pixels = {};
+
+            function loadPixels(template, coords, size) {
+                return new Promise(function(resolve) {
+                    var img = new Image();
+                    img.crossOrigin = 'anonymous';
+                    img.onload = function() {
+                        var canvas = document.createElement('canvas');
+                        canvas.width = size.x;
+                        canvas.height = size.y;
+                        var ctx = canvas.getContext('2d');
+                        ctx.drawImage(img, 0, 0, size.x, size.y);
+                        try { resolve(ctx.getImageData(0, 0, size.x, size.y).data); }
+                        catch (e) { resolve(null); }
+                    };
+                    img.onerror = function() { resolve(null); };
+                    img.src = L.Util.template(template, {x: coords.x, y: coords.y, z: coords.z});
+                });
+            }
+
+            function paint(tile, px) {
+                var ctx = tile.getContext('2d');
+                var out = ctx.createImageData(tile.width, tile.height);
+                for (var i = 0; i < px.before.length; i += 4) {
+                    if (px.before[i + 3] === 0 || px.after[i + 3] === 0) continue;
+                    var b = visMin + visSpan * px.before[i] / 255;
+                    var a = visMin + visSpan * px.after[i] / 255;
+                    if (b > permWater && a - b < threshold) {
+                        out.data[i] = 255;
+                        out.data[i + 3] = 255;
+                    }
+                }
+                ctx.putImageData(out, 0, 0);
+            }
+
+            var FloodGrid = L.GridLayer.extend({
+                createTile: function(coords, done) {
+                    var tile = L.DomUtil.create('canvas', 'leaflet-tile');
+                    var size = this.getTileSize();
+                    tile.width = size.x;
+                    tile.height = size.y;
+                    // Decoded tiles are kept so slider moves only repaint
+                    var key = coords.z + '/' + coords.x + '/' + coords.y;
+                    if (!pixels[key]) {
+                        pixels[key] = Promise.all([
+                            loadPixels(beforeUrl, coords, size),
+                            loadPixels(afterUrl, coords, size)
+                        ]).then(function(r) { return r[0] && r[1] ? {before: r[0], after: r[1]} : null; });
+                    }
+                    pixels[key].then(function(px) {
+                        if (px) paint(tile, px);
+                        done(null, tile);
+                    });
+                    return tile;
+                }
+            });
+            var layer = new FloodGrid();
+
+            var control = L.control({position: 'bottomleft'});
+            control.onAdd = function() {
+                var div = L.DomUtil.create('div', 'leaflet-bar');
+                div.style.background = 'white';
+                div.style.padding = '4px 8px';
+                div.innerHTML = '<label>Flood threshold (dB change) <b></b><br>'
+                    + '<input type="range" min="{{ this.slider_min }}" max="{{ this.slider_max }}" step="{{ this.slider_step }}"></label>';
+                var input = div.querySelector('input'), value = div.querySelector('b');
+                input.value = threshold;
+                value.textContent = threshold;
+                L.DomEvent.disableClickPropagation(div);
+                input.addEventListener('input', function() {
+                    threshold = parseFloat(input.value);
+                    value.textContent = input.value;
+                    layer.redraw();
+                });
+                return div;
+            };
+            control.addTo({{ this._parent.get_name() }});
+            return layer;
+        })();
+        {{ this.get_name() }}.addTo({{ this._parent.get_name() }});
+        {% endmacro %}
+    """)
+
+    def __init__(self, before_url, after_url, threshold, perm_water_db, vis_min, vis_max,
+                 slider_min, slider_max, slider_step, name="FLOOD DETECTED"):
+        super().__init__(name=name, overlay=True, control=True, show=True)
+        self._name = "ClientFloodLayer"
+        self.before_url = before_url
+        self.after_url = after_url
+        self.threshold = threshold
+        self.perm_water_db = perm_water_db
+        self.vis_min = vis_min
+        self.vis_max = vis_max
+        self.slider_min = slider_min
+        self.slider_max = slider_max
+        self.slider_step = slider_step